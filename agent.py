@@ -1,6 +1,16 @@
-from tools import search_knowledge_base, get_current_weather, search_web
+from tools import (
+    close_http_session,
+    get_chroma_collection,
+    get_current_weather,
+    get_embedding_model,
+    search_knowledge_base,
+    search_web,
+    set_shared,
+)
 
+import asyncio
 import logging
+import os
 
 from dotenv import load_dotenv
 from livekit.agents import (
@@ -28,7 +38,7 @@ AGENT_INSTRUCTIONS = """
 
 لديك وصول إلى ثلاث أدوات:
 1. search_knowledge_base - للبحث في قاعدة المعرفة (تجريبية حالياً)
-2. get_current_weather - للحصول على الطقس الحالي لأي مدينة , It very recomended to write the city name in english like "Rabat", "Casablanca", "Beni Mellal"
+2. get_current_weather - للحصول على الطقس الحالي لأي مدينة. مرر اسم المدينة بالعربية كما قالها المستخدم (الأداة تتولى التحويل)، والأسماء الإنجليزية مقبولة أيضاً
 3. search_web - للبحث على الإنترنت عن معلومات حديثة
 
 استخدم الأداة المناسبة حسب السؤال:
@@ -59,15 +69,37 @@ class Assistant(Agent):
 
 
 def prewarm(proc: JobProcess):
-    """Load models (VAD) before accepting jobs."""
+    """Load models (VAD, embedder, ChromaDB) before accepting jobs."""
     proc.userdata["vad"] = silero.VAD.load()
+    proc.userdata["chroma"] = get_chroma_collection()
+
+    if os.getenv("EMBEDDING_SIDECAR_URL"):
+        # No local model to load, but still page the HNSW index into
+        # memory before the first user turn (384 = MiniLM dimension);
+        # must be a unit vector since cosine distance to a zero vector
+        # is undefined
+        proc.userdata["chroma"].query(query_embeddings=[[1.0] + [0.0] * 383], n_results=1)
+    else:
+        proc.userdata["embedder"] = get_embedding_model()
+
+        # One throwaway query warms the encoder and pages the HNSW index
+        # into memory before the first user turn
+        warmup_vec = proc.userdata["embedder"].encode("تحميل")
+        proc.userdata["chroma"].query(query_embeddings=[warmup_vec.tolist()], n_results=1)
 
 
 async def entrypoint(ctx: JobContext):
     """Main LiveKit entrypoint."""
+    # Kick off the SFU handshake first so it overlaps with local
+    # session/agent construction
+    logger.info(f"Connecting to LiveKit room: {ctx.room.name}")
+    connect_task = asyncio.create_task(ctx.connect())
+
     ctx.log_context_fields = {"room": ctx.room.name}
+    set_shared(ctx.proc.userdata)
 
     session = AgentSession(
+        vad=ctx.proc.userdata["vad"],
         llm=openai.realtime.RealtimeModel(
             modalities=["text", "audio"],
             voice="alloy",
@@ -91,9 +123,13 @@ async def entrypoint(ctx: JobContext):
         logger.info(f"Usage: {summary}")
 
     ctx.add_shutdown_callback(log_usage)
+    ctx.add_shutdown_callback(close_http_session)
 
     agent = Assistant()
 
+    await connect_task
+    logger.info("Connected successfully.")
+
     await session.start(
         agent=agent,
         room=ctx.room,
@@ -102,10 +138,6 @@ async def entrypoint(ctx: JobContext):
         ),
     )
 
-    logger.info(f"Connecting to LiveKit room: {ctx.room.name}")
-    await ctx.connect()
-    logger.info("Connected successfully.")
-
 
 if __name__ == "__main__":
     cli.run_app(
@@ -1,11 +1,23 @@
 import logging
 import os
-import requests
+import re
+import aiohttp
 import asyncio
+import time
+import numpy as np
+import orjson
+import torch
+from collections import OrderedDict
 from datetime import datetime
-from livekit.agents import function_tool
+from urllib.parse import quote
+from livekit.agents import RunContext, function_tool
 from chromadb import PersistentClient
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+try:
+    from model2vec import StaticModel
+except ImportError:
+    StaticModel = None
 
 logger = logging.getLogger("tools")
 
@@ -14,23 +26,254 @@ _embedding_model = None
 _chroma_client = None
 _collection = None
 
+_EMBEDDING_MODEL_ID = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+_STATIC_MODEL_ID = "minishlab/potion-multilingual-128M"
+_QUANTIZED_MODEL_DIR = "./models/miniLM-int8-onnx"
+_QUANTIZED_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+# HNSW ef_search tuned for top-3 retrieval (Chroma's default favors
+# recall at higher k and costs latency)
+_HNSW_SEARCH_EF = 40
+
+# Point CHROMA_DB_PATH at tmpfs or fast SSD storage in deployment
+_CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+
+# Per-process shared objects loaded in agent.py::prewarm (set via set_shared)
+_shared = {}
+
+# Shared HTTP session: keep-alive connections are reused across tool calls
+_http = None
+
+
+async def get_http_session():
+    """Lazy create the shared aiohttp session"""
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=8),
+            connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=60),
+        )
+    return _http
+
+
+async def close_http_session():
+    """Close the shared aiohttp session (shutdown callback)"""
+    global _http
+    if _http is not None and not _http.closed:
+        await _http.close()
+    _http = None
+
+
+def set_shared(userdata):
+    """Receive the prewarmed objects from JobProcess.userdata"""
+    global _shared
+    _shared = userdata
+
+
+# Arabic -> English names for common cities, so the LLM can pass the city
+# as spoken and WeatherAPI still resolves it (also keeps cache keys stable)
+_CITY_MAP = {
+    "الرباط": "Rabat",
+    "الدار البيضاء": "Casablanca",
+    "كازابلانكا": "Casablanca",
+    "بني ملال": "Beni Mellal",
+    "مراكش": "Marrakesh",
+    "فاس": "Fes",
+    "طنجة": "Tangier",
+    "أكادير": "Agadir",
+    "مكناس": "Meknes",
+    "وجدة": "Oujda",
+    "تطوان": "Tetouan",
+    "القنيطرة": "Kenitra",
+    "آسفي": "Safi",
+    "العيون": "Laayoune",
+    "القاهرة": "Cairo",
+    "الإسكندرية": "Alexandria",
+    "الرياض": "Riyadh",
+    "جدة": "Jeddah",
+    "مكة": "Mecca",
+    "دبي": "Dubai",
+    "أبوظبي": "Abu Dhabi",
+    "الدوحة": "Doha",
+    "الكويت": "Kuwait City",
+    "المنامة": "Manama",
+    "مسقط": "Muscat",
+    "بيروت": "Beirut",
+    "عمان": "Amman",
+    "بغداد": "Baghdad",
+    "دمشق": "Damascus",
+    "صنعاء": "Sanaa",
+    "الخرطوم": "Khartoum",
+    "تونس": "Tunis",
+    "الجزائر": "Algiers",
+    "نواكشوط": "Nouakchott",
+    "طرابلس": "Tripoli",
+}
+
+# Tool-result caches: weather and news rarely change within a session,
+# so repeat queries skip the HTTP round trip entirely
+_WEATHER_TTL = 300  # seconds; cache key includes the 5-min bucket
+_WEATHER_CACHE_SIZE = 64
+_weather_cache = OrderedDict()  # (city_lower, bucket) -> result str
+_WEB_CACHE_TTL = 600
+_WEB_CACHE_SIZE = 128
+_web_cache = OrderedDict()  # normalized query -> (timestamp, result str)
+
+# Exact-match cache: literal repeat questions skip even the embedding step.
+# Checked before the semantic cache since a dict lookup is far cheaper.
+_ARABIC_DIACRITICS = re.compile("[\u064B-\u0652]")
+_EXACT_CACHE_SIZE = 512
+_exact_cache = OrderedDict()  # normalized query -> result str
+
+
+def _normalize_query(query):
+    """Lowercase, collapse whitespace, and strip Arabic diacritics"""
+    return " ".join(_ARABIC_DIACRITICS.sub("", query).strip().lower().split())
+
+
+def _exact_cache_put(norm_query, response):
+    _exact_cache[norm_query] = response
+    _exact_cache.move_to_end(norm_query)
+    while len(_exact_cache) > _EXACT_CACHE_SIZE:
+        _exact_cache.popitem(last=False)
+
+
+# Semantic query cache: near-identical queries skip the Chroma search
+_SEMANTIC_CACHE_THRESHOLD = 0.95
+_SEMANTIC_CACHE_SIZE = 256
+_cache_vecs = None  # np.ndarray (N, dim) of L2-normalized query embeddings
+_cache_resp = []
+_cache_pos = 0
+
+
+def _semantic_cache_get(query_vec):
+    """Return a cached response if a prior query is close enough, else None"""
+    if _cache_vecs is None or not _cache_resp:
+        return None
+    sims = _cache_vecs[:len(_cache_resp)] @ query_vec
+    best = int(np.argmax(sims))
+    if sims[best] > _SEMANTIC_CACHE_THRESHOLD:
+        return _cache_resp[best]
+    return None
+
+
+def _semantic_cache_put(query_vec, response):
+    """Store (embedding, response), overwriting the oldest entry when full"""
+    global _cache_vecs, _cache_pos
+    if _cache_vecs is None:
+        _cache_vecs = np.empty((_SEMANTIC_CACHE_SIZE, query_vec.shape[0]), dtype=np.float32)
+    if len(_cache_resp) < _SEMANTIC_CACHE_SIZE:
+        _cache_vecs[len(_cache_resp)] = query_vec
+        _cache_resp.append(response)
+    else:
+        _cache_vecs[_cache_pos] = query_vec
+        _cache_resp[_cache_pos] = response
+        _cache_pos = (_cache_pos + 1) % _SEMANTIC_CACHE_SIZE
+
+
+def _load_quantized_model():
+    """Load the INT8 ONNX build of the embedding model, quantizing it once if needed"""
+    if os.path.isfile(os.path.join(_QUANTIZED_MODEL_DIR, _QUANTIZED_MODEL_FILE)):
+        logger.info("Loading cached INT8 ONNX embedding model...")
+        return SentenceTransformer(
+            _QUANTIZED_MODEL_DIR,
+            backend="onnx",
+            model_kwargs={"file_name": _QUANTIZED_MODEL_FILE},
+            local_files_only=True,
+        )
+
+    logger.info("Quantizing embedding model to INT8 ONNX (one-time export)...")
+    model = SentenceTransformer(_EMBEDDING_MODEL_ID, backend="onnx")
+    model.save_pretrained(_QUANTIZED_MODEL_DIR)
+    # The string config selects INT8 GEMM via AVX512-VNNI where the host
+    # supports it, and names the exported file model_qint8_avx512_vnni.onnx
+    export_dynamic_quantized_onnx_model(model, "avx512_vnni", _QUANTIZED_MODEL_DIR)
+    return SentenceTransformer(
+        _QUANTIZED_MODEL_DIR,
+        backend="onnx",
+        model_kwargs={"file_name": _QUANTIZED_MODEL_FILE},
+    )
+
+
+class _StaticEmbedder:
+    """Adapter giving Model2Vec's StaticModel the encode() signature we use"""
+
+    def __init__(self, model):
+        self._model = model
+
+    def encode(self, query, **kwargs):
+        vec = np.asarray(self._model.encode(query), dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+async def _embed_query(query):
+    """Embed a query locally, or via the sidecar service when configured"""
+    sidecar_url = os.getenv("EMBEDDING_SIDECAR_URL")
+    if sidecar_url:
+        # One sidecar (e.g. michaelfeil/infinity) serves every worker
+        # process, so the model is resident once per host and concurrent
+        # requests get batched
+        http = await get_http_session()
+        async with http.post(
+            f"{sidecar_url.rstrip('/')}/embeddings",
+            json={"model": _EMBEDDING_MODEL_ID, "input": [query]},
+        ) as response:
+            response.raise_for_status()
+            data = orjson.loads(await response.read())
+        vec = np.asarray(data["data"][0]["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    model = get_embedding_model()
+    # Run the CPU-bound forward pass off the event loop
+    vec = await asyncio.to_thread(
+        model.encode, query, normalize_embeddings=True, convert_to_numpy=True
+    )
+    return vec.astype(np.float32)
+
+
+def _load_embedding_model():
+    """Pick the fastest embedding backend for the host hardware"""
+    # Opt-in static embeddings: ~100x faster than the transformer on CPU,
+    # but the chroma_db must have been built with the same model
+    if os.getenv("EMBEDDING_BACKEND", "").lower() == "model2vec":
+        if StaticModel is None:
+            logger.warning("EMBEDDING_BACKEND=model2vec but model2vec is not installed, falling back")
+        else:
+            logger.info("Loading Model2Vec static embedding model...")
+            return _StaticEmbedder(StaticModel.from_pretrained(_STATIC_MODEL_ID))
+    if torch.cuda.is_available():
+        # FP16 halves bandwidth and doubles throughput on GPU with
+        # negligible embedding quality loss
+        logger.info("Loading FP16 embedding model on GPU...")
+        model = SentenceTransformer(_EMBEDDING_MODEL_ID, device="cuda")
+        model.half()
+        return model
+    return _load_quantized_model()
+
 
 def get_embedding_model():
-    """Lazy load embedding model"""
+    """Return the shared embedding model, falling back to lazy load"""
     global _embedding_model
+    if _embedding_model is None:
+        _embedding_model = _shared.get("embedder")
     if _embedding_model is None:
         logger.info("Loading embedding model...")
-        _embedding_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+        _embedding_model = _load_embedding_model()
     return _embedding_model
 
 
 def get_chroma_collection():
-    """Lazy load ChromaDB collection"""
+    """Return the shared ChromaDB collection, falling back to lazy load"""
     global _chroma_client, _collection
+    if _collection is None:
+        _collection = _shared.get("chroma")
     if _collection is None:
         logger.info("Loading ChromaDB collection...")
-        _chroma_client = PersistentClient(path="./chroma_db")
+        _chroma_client = PersistentClient(path=_CHROMA_DB_PATH)
         _collection = _chroma_client.get_collection(name="arabica_qa")
+        _collection.modify(metadata={"hnsw:search_ef": _HNSW_SEARCH_EF})
     return _collection
 
 
@@ -61,30 +304,44 @@ async def search_knowledge_base(query: str) -> str:
     - "أخبرني عن تاريخ الأندلس"
     """
     logger.info(f"🔍 RAG Tool called: {query}")
-    
+
+    norm_query = _normalize_query(query)
+    cached = _exact_cache.get(norm_query)
+    if cached is not None:
+        logger.info("✅ Exact cache hit")
+        _exact_cache.move_to_end(norm_query)
+        return cached
+
     try:
-        # Get models/collections
-        model = get_embedding_model()
         collection = get_chroma_collection()
-        
-        # Generate query embedding
-        query_embedding = model.encode(query).tolist()
-        
-        # Search ChromaDB
-        results = collection.query(
-            query_embeddings=[query_embedding],
+
+        # Generate query embedding (L2-normalized for the semantic cache)
+        query_vec = await _embed_query(query)
+
+        # Check the semantic cache before hitting ChromaDB
+        cached = _semantic_cache_get(query_vec)
+        if cached is not None:
+            logger.info("✅ Semantic cache hit")
+            _exact_cache_put(norm_query, cached)
+            return cached
+
+        # Search ChromaDB (also off the event loop)
+        results = await asyncio.to_thread(
+            collection.query,
+            query_embeddings=query_vec[None, :],
             n_results=3
         )
         
         # Format results
         if results['documents'] and results['documents'][0]:
             contexts = results['documents'][0]
-            formatted = "المعلومات من قاعدة المعرفة:\n\n"
-            for i, context in enumerate(contexts, 1):
-                formatted += f"{i}. {context[:300]}...\n\n"
-            
+            parts = ["المعلومات من قاعدة المعرفة:\n\n"]
+            parts.extend(f"{i}. {context[:300]}...\n\n" for i, context in enumerate(contexts, 1))
+            formatted = "".join(parts)
+
             logger.info(f"✅ Found {len(contexts)} relevant documents")
-            await asyncio.sleep(0.1)
+            _semantic_cache_put(query_vec, formatted)
+            _exact_cache_put(norm_query, formatted)
             return formatted
         else:
             logger.info("No results found in knowledge base")
@@ -112,8 +369,9 @@ async def get_current_weather(city: str) -> str:
     - General information about cities
     
     Args:
-        city: Name of the city (WARNING: Recomended to use English City Names)
-              Examples: "الرباط" -> "Rabat", "الدار البيضاء" -> "Casablanca"
+        city: Name of the city, in Arabic as spoken or in English.
+              Common Arabic names are normalized automatically
+              (e.g. "الرباط", "الدار البيضاء", "Rabat" all work)
         
     Returns:
         Current weather conditions including temperature, humidity, and conditions
@@ -125,14 +383,23 @@ async def get_current_weather(city: str) -> str:
     """
 
     logger.info(f"🌤️ Weather tool called for: {city}")
-    
+
+    city_en = _CITY_MAP.get(city.strip(), city.strip())
+    cache_key = (city_en.lower(), int(time.time()) // _WEATHER_TTL)
+    cached = _weather_cache.get(cache_key)
+    if cached is not None:
+        logger.info("✅ Weather cache hit")
+        _weather_cache.move_to_end(cache_key)
+        return cached
+
     try:
         api_key = os.getenv("WEATHERAPI_KEY")
-        url = f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={city}&aqi=no"
-        
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
+        url = f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={quote(city_en)}&aqi=no"
+
+        http = await get_http_session()
+        async with http.get(url) as response:
+            response.raise_for_status()
+            data = orjson.loads(await response.read())
         
         current = data["current"]
         location = data["location"]
@@ -146,6 +413,10 @@ async def get_current_weather(city: str) -> str:
 - سرعة الرياح: {current['wind_kph']} كم/ساعة"""
         
         logger.info(f"✅ Weather retrieved: {current['temp_c']}°C, {current['condition']['text']}")
+        _weather_cache[cache_key] = result
+        _weather_cache.move_to_end(cache_key)
+        while len(_weather_cache) > _WEATHER_CACHE_SIZE:
+            _weather_cache.popitem(last=False)
         return result
         
     except Exception as e:
@@ -154,7 +425,7 @@ async def get_current_weather(city: str) -> str:
 
 
 @function_tool
-async def search_web(query: str) -> str:
+async def search_web(context: RunContext, query: str) -> str:
     """
     Search the web for current information, news, and recent events.
     
@@ -181,7 +452,21 @@ async def search_web(query: str) -> str:
     - "ما الجديد في عالم التكنولوجيا؟"
     """
     logger.info(f"🔎 Web search called: {query}")
-    
+
+    cache_key = " ".join(query.strip().lower().split())
+    cached = _web_cache.get(cache_key)
+    if cached is not None and time.time() - cached[0] < _WEB_CACHE_TTL:
+        logger.info("✅ Web search cache hit")
+        _web_cache.move_to_end(cache_key)
+        return cached[1]
+
+    # Give interim feedback so the user isn't met with silence during the
+    # search round trip; generate_reply works with the realtime model,
+    # where say() would require a TTS plugin
+    context.session.generate_reply(
+        instructions="أخبر المستخدم بجملة قصيرة جداً أنك تبحث عن ذلك الآن."
+    )
+
     try:
         api_key = os.getenv("TAVILY_API_KEY")
         url = "https://api.tavily.com/search"
@@ -193,19 +478,24 @@ async def search_web(query: str) -> str:
             "max_results": 3
         }
         
-        response = requests.post(url, json=payload, timeout=8)
-        response.raise_for_status()
-        data = response.json()
+        http = await get_http_session()
+        async with http.post(url, json=payload) as response:
+            response.raise_for_status()
+            data = orjson.loads(await response.read())
         
         if data.get("results"):
-            formatted = "نتائج البحث:\n\n"
+            parts = ["نتائج البحث:\n\n"]
             for i, result in enumerate(data["results"][:3], 1):
-                formatted += f"{i}. {result['title']}\n"
-                formatted += f"   {result['content'][:200]}...\n"
-                formatted += f"   المصدر: {result['url']}\n\n"
-            
+                parts.append(f"{i}. {result['title']}\n")
+                parts.append(f"   {result['content'][:200]}...\n")
+                parts.append(f"   المصدر: {result['url']}\n\n")
+            formatted = "".join(parts)
+
             logger.info(f"✅ Found {len(data['results'])} results")
-            await asyncio.sleep(0.1)
+            _web_cache[cache_key] = (time.time(), formatted)
+            _web_cache.move_to_end(cache_key)
+            while len(_web_cache) > _WEB_CACHE_SIZE:
+                _web_cache.popitem(last=False)
             return formatted
         else:
             return "لم أجد نتائج ذات صلة بهذا الموضوع."